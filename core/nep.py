@@ -1,42 +1,90 @@
 import asyncio
 import logging
-from typing import Dict, Any
+import struct
+from typing import Dict, Any, List
+
+import msgpack
 
 from utils.auth import authenticate
 from utils.rate_limiter import RateLimiter
+from utils.net import tune_socket
+from utils.session_cache import SessionCache
 from models.mail import EmailMessage
 
 logger = logging.getLogger(__name__)
 
+# 帧头: 4字节大端长度
+_FRAME_HEADER = struct.Struct("!I")
+
+def frame(body: bytes) -> bytes:
+    """为已编码的消息体加上NEP协议帧头: [u32长度][MessagePack消息体]"""
+    return _FRAME_HEADER.pack(len(body)) + body
+
+def frame_parts(parts: List[bytes]) -> List[bytes]:
+    """为分段编码的消息体加上帧头，返回的分段列表直接交给writelines()，无需先拼接"""
+    return [_FRAME_HEADER.pack(sum(map(len, parts)))] + parts
+
+def pack_frame(message: Dict[str, Any]) -> bytes:
+    """编码NEP协议帧"""
+    return frame(msgpack.packb(message, use_bin_type=True))
+
+# 默认请求帧大小上限
+DEFAULT_MAX_REQUEST_SIZE = 1024 * 1024
+# 请求必须是MessagePack map: fixmap (0x80-0x8f)、map16 (0xde)、map32 (0xdf)
+_MAP_MARKERS = frozenset(range(0x80, 0x90)) | {0xde, 0xdf}
+
+# 固定响应在模块加载时预先编码
+_ERR_RATE_LIMIT = pack_frame({'status': 'error', 'code': 'rate_limit_exceeded'})
+_ERR_INVALID_REQUEST = pack_frame({'status': 'error', 'code': 'invalid_request'})
+_ERR_SERVER = pack_frame({'status': 'error', 'code': 'server_error'})
+_ERR_INVALID_DATA = pack_frame({'status': 'error', 'code': 'invalid_data'})
+_ERR_STORAGE = pack_frame({'status': 'error', 'code': 'storage_error'})
+_AUTH_OK = pack_frame({'status': 'ok'})
+_AUTH_FAILED = pack_frame({'status': 'error', 'code': 'auth_failed'})
+
+# {'status': 'ok', 'message_id': ...} 的固定前缀，只需追加message_id的编码
+_OK_MESSAGE_ID_PREFIX = b'\x82' + b''.join(
+    msgpack.packb(s) for s in ('status', 'ok', 'message_id')
+)
+# {'status': 'ok', 'emails': [...]} 的固定前缀，之后为数组头和逐封邮件的编码
+_OK_EMAILS_PREFIX = b'\x82' + b''.join(
+    msgpack.packb(s) for s in ('status', 'ok', 'emails')
+)
+_packer = msgpack.Packer()
+
 class NEPServer:
     def __init__(self, config: Dict[str, Any], storage):
         self.config = config
         self.storage = storage
         self.rate_limiter = RateLimiter(config['rate_limits'])
+        self.session_cache = SessionCache(storage)
+        self.max_request_size = config.get('max_request_size', DEFAULT_MAX_REQUEST_SIZE)
         self.server = None
 
     async def handle_client(self, reader, writer):
         """处理客户端连接"""
         client_addr = writer.get_extra_info('peername')
         logger.info(f"New NEP connection from {client_addr}")
+        tune_socket(writer)
         
         try:
-            # 认证
-            auth_data = await reader.read(1024)
-            session = await authenticate(auth_data, self.storage)
+            # 认证 (凭据与请求一样以一个帧发送)
+            auth_data = await self.read_frame(reader, writer)
+            if auth_data is None:
+                return
+            session = await self.authenticate(auth_data)
             if not session:
-                writer.write(b"AUTH_FAILED")
+                writer.write(_AUTH_FAILED)
                 await writer.drain()
-                writer.close()
                 return
             
-            writer.write(b"AUTH_OK")
+            writer.write(_AUTH_OK)
             await writer.drain()
             
             # 处理客户端请求
             while True:
-                data = await reader.read(4096)
-                if not data:
+                data = await self.read_frame(reader, writer)
+                if data is None:
                     break
                     
                 await self.process_request(data, session, writer)
@@ -47,17 +95,45 @@ class NEPServer:
             writer.close()
             await writer.wait_closed()
 
+    async def read_frame(self, reader, writer):
+        """读取一个帧的消息体，连接已关闭或帧超过大小上限 (此时已回复错误) 时返回None"""
+        try:
+            header = await reader.readexactly(4)
+        except asyncio.IncompleteReadError:
+            return None
+        (length,) = _FRAME_HEADER.unpack(header)
+        if length > self.max_request_size:
+            # 不读取超大帧，之后的数据无法再按帧解析，调用方应断开连接
+            writer.write(_ERR_INVALID_REQUEST)
+            await writer.drain()
+            return None
+        return await reader.readexactly(length)
+
+    async def authenticate(self, auth_data: bytes):
+        """认证客户端，相同凭据短时间内重连时直接使用缓存的会话"""
+        session = self.session_cache.get(auth_data)
+        if session is None:
+            session = await authenticate(auth_data, self.storage)
+            if session:
+                self.session_cache.put(auth_data, session)
+        return session
+
     async def process_request(self, data: bytes, session: Dict[str, Any], writer):
         """处理客户端请求"""
+        # 解析前先检查结构，格式错误的请求不进入解码
+        if not data or data[0] not in _MAP_MARKERS:
+            writer.write(_ERR_INVALID_REQUEST)
+            await writer.drain()
+            return
+            
         try:
-            # 解析请求 (这里简化为JSON，实际可以使用更高效的二进制协议)
-            import json
-            request = json.loads(data.decode())
+            # 解析请求 (MessagePack帧，附件等二进制字段保持为bytes)
+            # 帧数据以bytes/memoryview直接交给解码器，不经过str
+            request = msgpack.unpackb(data, raw=False)
             
             # 检查速率限制
             if not self.rate_limiter.check_limit(session['user_id'], request['type']):
-                response = {'status': 'error', 'code': 'rate_limit_exceeded'}
-                writer.write(json.dumps(response).encode())
+                writer.write(_ERR_RATE_LIMIT)
                 await writer.drain()
                 return
                 
@@ -71,22 +147,19 @@ class NEPServer:
             elif request['type'] == 'update':
                 await self.handle_update(request, session, writer)
             else:
-                response = {'status': 'error', 'code': 'invalid_request'}
-                writer.write(json.dumps(response).encode())
+                writer.write(_ERR_INVALID_REQUEST)
                 await writer.drain()
                 
         except Exception as e:
             logger.error(f"Error processing request: {e}")
-            response = {'status': 'error', 'code': 'server_error'}
-            writer.write(json.dumps(response).encode())
+            writer.write(_ERR_SERVER)
             await writer.drain()
 
     async def handle_send(self, request: Dict[str, Any], session: Dict[str, Any], writer):
         """处理发送邮件请求"""
         # 验证请求数据
         if not all(k in request for k in ['to', 'subject', 'body']):
-            response = {'status': 'error', 'code': 'invalid_data'}
-            writer.write(json.dumps(response).encode())
+            writer.write(_ERR_INVALID_DATA)
             await writer.drain()
             return
             
@@ -102,12 +175,13 @@ class NEPServer:
         # 存储邮件
         try:
             await self.storage.store_email(email)
-            response = {'status': 'ok', 'message_id': email.message_id}
+            self.storage.notify_email_stored(email)
+            response = frame_parts([_OK_MESSAGE_ID_PREFIX, msgpack.packb(email.message_id)])
         except Exception as e:
             logger.error(f"Error storing email: {e}")
-            response = {'status': 'error', 'code': 'storage_error'}
+            response = [_ERR_STORAGE]
             
-        writer.write(json.dumps(response).encode())
+        writer.writelines(response)
         await writer.drain()
 
     async def handle_list(self, request: Dict[str, Any], session: Dict[str, Any], writer):
@@ -117,16 +191,13 @@ class NEPServer:
         offset = request.get('offset', 0)
         
         try:
-            emails = await self.storage.list_emails(session['email'], mailbox, limit, offset)
-            response = {
-                'status': 'ok',
-                'emails': [email.to_dict() for email in emails]
-            }
+            emails = await self.storage.list_emails_raw(session['email'], mailbox, limit, offset, codec='msgpack')
+            response = frame_parts([_OK_EMAILS_PREFIX, _packer.pack_array_header(len(emails))] + emails)
         except Exception as e:
             logger.error(f"Error listing emails: {e}")
-            response = {'status': 'error', 'code': 'storage_error'}
+            response = [_ERR_STORAGE]
             
-        writer.write(json.dumps(response).encode())
+        writer.writelines(response)
         await writer.drain()
 
     async def start(self):
@@ -1,25 +1,52 @@
+import asyncio
 import logging
-from typing import Dict, Any
+import socket
+from typing import Dict, Any, Awaitable, Callable, Tuple
+
+import orjson
+import uvicorn
+from cachetools import TTLCache
 
 from fastapi import FastAPI, Request, HTTPException
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi.responses import HTMLResponse, ORJSONResponse, Response
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
+from jinja2 import FileSystemBytecodeCache
 
 from utils.auth import authenticate_web
 from utils.converter import nep_to_http, http_to_nep
-from models.mail import EmailMessage
+from utils.session_cache import SessionCache
+from models.mail import EmailMessage, json_default
 
 logger = logging.getLogger(__name__)
 
-class NEPServer:
+# 邮件列表缓存，邮箱内容相对轮询频率变化很少
+LIST_CACHE_SIZE = 4096
+LIST_CACHE_TTL = 2
+
+def _template_json_dumps(obj, **kwargs) -> str:
+    return orjson.dumps(obj, default=json_default).decode()
+
+class NEPHServer:
     """NEP-H服务器，基于HTTP协议"""
     
     def __init__(self, config: Dict[str, Any], storage):
         self.config = config
         self.storage = storage
-        self.app = FastAPI(title="NEP-H Server")
+        # 多个工作进程通过SO_REUSEPORT共享端口，由内核分配连接
+        self.workers = config.get('workers', 1) if hasattr(socket, 'SO_REUSEPORT') else 1
+        self.app = FastAPI(title="NEP-H Server", default_response_class=ORJSONResponse)
         self.templates = Jinja2Templates(directory="web/templates")
+        # 模板在启动时编译，运行期间不检查文件变更
+        self.templates.env.auto_reload = False
+        self.templates.env.bytecode_cache = FileSystemBytecodeCache()
+        # 模板中的tojson同样使用orjson，支持直接传入的EmailMessage及其二进制附件
+        self.templates.env.policies['json.dumps_function'] = _template_json_dumps
+        self.session_cache = SessionCache(storage)
+        # (类型, 邮箱地址, mailbox, limit, offset) -> 邮件列表或已编码的JSON
+        self.list_cache = TTLCache(maxsize=LIST_CACHE_SIZE, ttl=LIST_CACHE_TTL)
+        self._list_locks: Dict[Tuple, asyncio.Lock] = {}
+        storage.add_listener(self._on_storage_event)
         
         self._setup_routes()
         self._mount_static()
@@ -46,6 +73,52 @@ class NEPServer:
         """挂载静态文件"""
         self.app.mount("/static", StaticFiles(directory="web/static"), name="static")
 
+    async def authenticate(self, request: Request):
+        """认证Web请求，按会话Cookie或Authorization头缓存认证结果"""
+        credentials = request.cookies.get('session_id') or request.headers.get('authorization')
+        if not credentials:
+            return await authenticate_web(request)
+            
+        credentials = credentials.encode()
+        session = self.session_cache.get(credentials)
+        if session is None:
+            session = await authenticate_web(request)
+            if session:
+                self.session_cache.put(credentials, session)
+        return session
+
+    async def _cached_list(self, key: Tuple, load: Callable[[], Awaitable[Any]]):
+        """从列表缓存中获取，未命中时加载 (同一个键的并发请求只加载一次)"""
+        value = self.list_cache.get(key)
+        if value is not None:
+            return value
+            
+        lock = self._list_locks.setdefault(key, asyncio.Lock())
+        try:
+            async with lock:
+                value = self.list_cache.get(key)
+                if value is None:
+                    value = await load()
+                    self.list_cache[key] = value
+        finally:
+            # 加载失败时同样移除锁，避免残留
+            if not lock.locked():
+                self._list_locks.pop(key, None)
+        return value
+
+    def _on_storage_event(self, event: str, key: str):
+        """邮箱内容变更时清除其列表缓存"""
+        if event == 'mailbox':
+            for cache_key in [k for k in self.list_cache.keys() if k[1] == key]:
+                self.list_cache.pop(cache_key, None)
+
+    def _precompile_templates(self):
+        """预先编译全部HTML模板，避免首次请求时编译"""
+        env = self.templates.env
+        # 只处理.html文件，目录中的其他文件不是模板
+        for name in env.list_templates(extensions=['html']):
+            env.get_template(name)
+
     async def web_index(self, request: Request):
         """首页"""
         return self.templates.TemplateResponse("index.html", {"request": request})
@@ -53,49 +126,55 @@ class NEPServer:
     async def web_inbox(self, request: Request):
         """收件箱页面"""
         # 检查认证
-        session = await authenticate_web(request)
+        session = await self.authenticate(request)
         if not session:
             raise HTTPException(status_code=401, detail="Unauthorized")
             
         # 获取邮件列表
-        emails = await self.storage.list_emails(session['email'], 'INBOX', 50, 0)
+        emails = await self._cached_list(
+            ('inbox', session['email'], 'INBOX', 50, 0),
+            lambda: self.storage.list_emails(session['email'], 'INBOX', 50, 0)
+        )
         
         return self.templates.TemplateResponse(
             "inbox.html",
             {
                 "request": request,
-                "emails": [email.to_dict() for email in emails]
+                "emails": emails
             }
         )
 
     async def api_auth(self, request: Request):
         """API认证"""
-        data = await request.json()
+        data = orjson.loads(await request.body())
         session = await authenticate_web(data)
         if not session:
             raise HTTPException(status_code=401, detail="Authentication failed")
             
-        return JSONResponse({"status": "ok", "session_id": session['session_id']})
+        return ORJSONResponse({"status": "ok", "session_id": session['session_id']})
 
     async def api_list_mails(self, request: Request, mailbox: str = "INBOX", limit: int = 50, offset: int = 0):
         """列出邮件API"""
-        session = await authenticate_web(request)
+        session = await self.authenticate(request)
         if not session:
             raise HTTPException(status_code=401, detail="Unauthorized")
             
-        emails = await self.storage.list_emails(session['email'], mailbox, limit, offset)
-        return JSONResponse({
-            "status": "ok",
-            "emails": [email.to_dict() for email in emails]
-        })
+        async def load():
+            # 直接拼接存储层返回的逐封JSON
+            emails = await self.storage.list_emails_raw(session['email'], mailbox, limit, offset)
+            return b'{"status":"ok","emails":[' + b','.join(emails) + b']}'
+            
+        # 缓存编码后的JSON，命中时无需访问存储和序列化
+        body = await self._cached_list(('api', session['email'], mailbox, limit, offset), load)
+        return Response(content=body, media_type="application/json")
 
     async def api_send_mail(self, request: Request):
         """发送邮件API"""
-        session = await authenticate_web(request)
+        session = await self.authenticate(request)
         if not session:
             raise HTTPException(status_code=401, detail="Unauthorized")
             
-        data = await request.json()
+        data = orjson.loads(await request.body())
         
         # 转换为NEP邮件格式
         nep_email = http_to_nep(data, session['email'])
@@ -103,17 +182,33 @@ class NEPServer:
         # 存储邮件
         try:
             await self.storage.store_email(nep_email)
-            return JSONResponse({"status": "ok", "message_id": nep_email.message_id})
+            self.storage.notify_email_stored(nep_email)
+            return ORJSONResponse({"status": "ok", "message_id": nep_email.message_id})
         except Exception as e:
             logger.error(f"Error storing email: {e}")
             raise HTTPException(status_code=500, detail="Failed to send email")
 
+    def _create_socket(self) -> socket.socket:
+        """创建监听套接字"""
+        host, port = self.config['host'], self.config['port']
+        sock = socket.socket(socket.AF_INET6 if ':' in host else socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if self.workers > 1:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        sock.bind((host, port))
+        return sock
+
     async def start(self):
-        """启动NEP-H服务器"""
-        import uvicorn
-        uvicorn.run(
+        """启动NEP-H服务器 (与其他服务器共享同一个事件循环)"""
+        self._precompile_templates()
+        
+        server = uvicorn.Server(uvicorn.Config(
             self.app,
             host=self.config['host'],
             port=self.config['port'],
-            log_level="info"
-        )
+            log_level="info",
+            loop="uvloop",
+            http="httptools",
+            access_log=False
+        ))
+        await server.serve(sockets=[self._create_socket()])
@@ -1,14 +1,34 @@
 import asyncio
 import logging
-import email
+from email import policy
 from email.message import EmailMessage as SMTPEmailMessage
+from email.parser import BytesFeedParser
+from typing import Dict, Any
 
 from utils.converter import nep_to_smtp, smtp_to_nep
 from utils.auth import authenticate_smtp
 from utils.rate_limiter import RateLimiter
+from utils.net import tune_socket
 
 logger = logging.getLogger(__name__)
 
+# StreamReader缓冲区上限，单行命令不会超过该长度
+STREAM_LIMIT = 2 ** 20
+# DATA阶段每次读取的块大小
+DATA_CHUNK_SIZE = 65536
+DATA_TERMINATOR = b'\r\n.\r\n'
+# 写缓冲区超过该大小时才在读取下一条命令前drain()
+WRITE_BUFFER_HIGH = 65536
+# 默认邮件大小上限 (DATA阶段接收的字节数)
+DEFAULT_MAX_MESSAGE_SIZE = 25 * 1024 * 1024
+
+class SMTPDataError(Exception):
+    """DATA阶段超出限制，reply为应回复客户端的响应行"""
+    
+    def __init__(self, reply: bytes):
+        super().__init__(reply)
+        self.reply = reply
+
 class NEPTServer:
     """NEP-T服务器，兼容传统SMTP协议"""
     
@@ -16,13 +36,28 @@ class NEPTServer:
         self.config = config
         self.storage = storage
         self.rate_limiter = RateLimiter(config['rate_limits'])
+        self.max_message_size = config.get('max_message_size', DEFAULT_MAX_MESSAGE_SIZE)
         self.server = None
+        
+        # SMTP命令分发表，以命令前4个字节 (大写) 为键
+        self.dispatch = {
+            b'HELO': self._do_helo,
+            b'EHLO': self._do_helo,
+            b'AUTH': self._do_auth,
+            b'MAIL': self._do_mail,
+            b'RCPT': self._do_rcpt,
+            b'DATA': self._do_data,
+            b'QUIT': self._do_quit,
+        }
 
     async def handle_client(self, reader, writer):
         """处理SMTP客户端连接"""
         client_addr = writer.get_extra_info('peername')
         logger.info(f"New NEP-T connection from {client_addr}")
-        
+        tune_socket(writer)
+        # 高水位为0时drain()会等到缓冲区完全写出
+        writer.transport.set_write_buffer_limits(high=0)
+
         try:
             # SMTP欢迎消息
             writer.write(b"220 NEP-T Server ready\r\n")
@@ -39,66 +74,91 @@ class NEPTServer:
 
     async def process_smtp(self, reader, writer):
         """处理SMTP协议"""
-        current_email = {
+        envelope = {
             'from': None,
             'to': [],
             'data': None
         }
-        
+        
         while True:
-            data = await reader.readuntil(b'\r\n')
-            if not data:
-                break
-                
-            line = data.decode().strip()
-            logger.debug(f"SMTP command: {line}")
-            
-            if line.upper().startswith('HELO') or line.upper().startswith('EHLO'):
-                writer.write(b"250 Hello\r\n")
-                await writer.drain()
-                
-            elif line.upper().startswith('AUTH'):
-                if await self.handle_smtp_auth(line, reader, writer):
-                    writer.write(b"235 Authentication successful\r\n")
-                else:
-                    writer.write(b"535 Authentication failed\r\n")
-                await writer.drain()
-                
-            elif line.upper().startswith('MAIL FROM:'):
-                current_email['from'] = line[10:].strip('<> ')
-                writer.write(b"250 OK\r\n")
-                await writer.drain()
-                
-            elif line.upper().startswith('RCPT TO:'):
-                current_email['to'].append(line[8:].strip('<> '))
-                writer.write(b"250 OK\r\n")
-                await writer.drain()
-                
-            elif line.upper() == 'DATA':
-                writer.write(b"354 End data with <CR><LF>.<CR><LF>\r\n")
-                await writer.drain()
-                
-                # 读取邮件数据
-                email_data = await self.read_email_data(reader)
-                current_email['data'] = email_data
-                
-                # 存储邮件
-                await self.store_smtp_email(current_email)
-                
-                writer.write(b"250 OK\r\n")
-                await writer.drain()
-                current_email = {'from': None, 'to': [], 'data': None}
-                
-            elif line.upper() == 'QUIT':
-                writer.write(b"221 Bye\r\n")
+            # 回复在write()时已尝试直接发送，只有积压过多时才等待
+            if writer.transport.get_write_buffer_size() > WRITE_BUFFER_HIGH:
                 await writer.drain()
+                
+            line = await reader.readuntil(b'\r\n')
+            if not line:
                 break
-                
-            else:
-                writer.write(b"500 Command not recognized\r\n")
-                await writer.drain()
+                
+            logger.debug("SMTP command: %r", line)
+            
+            handler = self.dispatch.get(line[:4].upper(), self._do_unknown)
+            if not await handler(line, reader, writer, envelope):
+                break
+
+    async def _do_helo(self, line: bytes, reader, writer, envelope) -> bool:
+        writer.write(b"250 Hello\r\n")
+        return True
+
+    async def _do_auth(self, line: bytes, reader, writer, envelope) -> bool:
+        if await self.handle_smtp_auth(line, reader, writer):
+            writer.write(b"235 Authentication successful\r\n")
+        else:
+            writer.write(b"535 Authentication failed\r\n")
+        return True
+
+    async def _do_mail(self, line: bytes, reader, writer, envelope) -> bool:
+        if line[:10].upper() != b'MAIL FROM:':
+            return await self._do_unknown(line, reader, writer, envelope)
+            
+        envelope['from'] = line[10:].strip(b'<> \r\n').decode()
+        writer.write(b"250 OK\r\n")
+        return True
+
+    async def _do_rcpt(self, line: bytes, reader, writer, envelope) -> bool:
+        if line[:8].upper() != b'RCPT TO:':
+            return await self._do_unknown(line, reader, writer, envelope)
+            
+        envelope['to'].append(line[8:].strip(b'<> \r\n').decode())
+        writer.write(b"250 OK\r\n")
+        return True
+
+    async def _do_data(self, line: bytes, reader, writer, envelope) -> bool:
+        if line.rstrip(b'\r\n').upper() != b'DATA':
+            return await self._do_unknown(line, reader, writer, envelope)
+            
+        writer.write(b"354 End data with <CR><LF>.<CR><LF>\r\n")
+        # 客户端等待此回复后才发送邮件内容
+        await writer.drain()
+        
+        # 读取邮件数据
+        try:
+            envelope['data'] = await self.read_email_data(reader)
+        except SMTPDataError as e:
+            # 剩余的邮件内容未读取，无法再按命令解析，回复后断开连接
+            writer.write(e.reply)
+            return False
+        
+        # 存储邮件
+        await self.store_smtp_email(envelope)
+        
+        writer.write(b"250 OK\r\n")
+        envelope['from'] = None
+        envelope['to'] = []
+        envelope['data'] = None
+        return True
+
+    async def _do_quit(self, line: bytes, reader, writer, envelope) -> bool:
+        if line.rstrip(b'\r\n').upper() != b'QUIT':
+            return await self._do_unknown(line, reader, writer, envelope)
+            
+        writer.write(b"221 Bye\r\n")
+        return False
 
-    async def handle_smtp_auth(self, auth_line: str, reader, writer) -> bool:
+    async def _do_unknown(self, line: bytes, reader, writer, envelope) -> bool:
+        writer.write(b"500 Command not recognized\r\n")
+        return True
+
+    async def handle_smtp_auth(self, auth_line: bytes, reader, writer) -> bool:
         """处理SMTP认证"""
         # 简化实现，实际应该支持多种认证机制
         parts = auth_line.split()
@@ -106,49 +166,69 @@ class NEPTServer:
             return False
             
         mechanism = parts[1].upper()
-        if mechanism == 'PLAIN':
+        if mechanism == b'PLAIN':
             # 读取认证数据
             auth_data = await reader.readuntil(b'\r\n')
             return await authenticate_smtp(auth_data.decode().strip(), self.storage)
             
         return False
 
-    async def read_email_data(self, reader) -> str:
-        """读取完整的SMTP邮件数据"""
-        data = []
+    async def read_email_data(self, reader) -> SMTPEmailMessage:
+        """读取SMTP邮件数据，边接收边解析；单行或整封邮件超过上限时抛出SMTPDataError"""
+        parser = BytesFeedParser(policy=policy.default)
+        # 以CRLF开头，使首行与其他行一样可以匹配结束标记和转义点
+        buf = bytearray(b'\r\n')
+        skip = 2
+        start = 0
+        scan = 0
+        received = 0
         while True:
-            line = await reader.readuntil(b'\r\n')
-            line_str = line.decode()
-            
-            # 检查结束标记
-            if line_str == '.\r\n':
+            end = buf.find(DATA_TERMINATOR, start)
+            if end != -1:
                 break
-                
-            # 处理转义点
-            if line_str.startswith('..'):
-                line_str = line_str[1:]
-                
-            data.append(line_str)
-            
-        return ''.join(data)
+                
+            # 只解析完整的行 (处理转义点)，保留最后的CRLF及未完成的行
+            # 只在新读入的数据中查找CRLF，更早的部分已确认不含CRLF
+            cut = buf.rfind(b'\r\n', scan)
+            if cut > 0:
+                parser.feed(bytes(buf[:cut].replace(b'\r\n..', b'\r\n.')[skip:]))
+                del buf[:cut]
+                skip = 0
+            elif len(buf) > STREAM_LIMIT:
+                raise SMTPDataError(b"500 Line too long\r\n")
+                
+            # 结束标记可能跨越两次读取
+            start = max(0, len(buf) - len(DATA_TERMINATOR) + 1)
+            # CRLF可能跨越两次读取
+            scan = max(0, len(buf) - 1)
+            chunk = await reader.read(DATA_CHUNK_SIZE)
+            if not chunk:
+                raise asyncio.IncompleteReadError(bytes(buf), None)
+            received += len(chunk)
+            if received > self.max_message_size:
+                raise SMTPDataError(b"552 Message size exceeds fixed maximum message size\r\n")
+            buf += chunk
+            
+        # 未声明PIPELINING，客户端在收到回复前不会发送后续命令
+        parser.feed(bytes(buf[:end + 2].replace(b'\r\n..', b'\r\n.')[skip:]))
+        return parser.close()
 
     async def store_smtp_email(self, email_data: Dict[str, Any]):
         """存储SMTP格式的邮件"""
-        # 解析SMTP邮件
-        msg = email.message_from_string(email_data['data'])
-        
-        # 转换为NEP格式
-        nep_email = smtp_to_nep(msg, email_data['from'], email_data['to'])
-        
+        # 转换为NEP格式 (邮件已在接收时解析)
+        nep_email = smtp_to_nep(email_data['data'], email_data['from'], email_data['to'])
+        
         # 存储邮件
         await self.storage.store_email(nep_email)
+        self.storage.notify_email_stored(nep_email)
 
     async def start(self):
         """启动NEP-T服务器"""
         self.server = await asyncio.start_server(
             self.handle_client,
             self.config['host'],
-            self.config['port']
+            self.config['port'],
+            limit=STREAM_LIMIT
         )
         
         logger.info(f"NEP-T server started on {self.config['host']}:{self.config['port']}")
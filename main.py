@@ -1,17 +1,34 @@
 import asyncio
 import logging
-from typing import Optional
+import multiprocessing
+from typing import List, Optional
+
+import uvicorn
 
 from core.nep import NEPServer
 from core.nept import NEPTServer
-from core.neph import NEPServer
+from core.neph import NEPHServer
 from web.app import create_app
 from config import load_config
 
 logger = logging.getLogger(__name__)
 
+def _install_uvloop():
+    try:
+        import uvloop
+        uvloop.install()
+    except ImportError:
+        pass  # 无uvloop (如Windows) 时使用默认事件循环
+
+def run_neph_worker(config_path: Optional[str]):
+    """NEP-H工作进程入口，在进程内独立初始化存储连接"""
+    _install_uvloop()
+    service = NEPService(config_path)
+    asyncio.run(service.neph_server.start())
+
 class NEPService:
     def __init__(self, config_path: Optional[str] = None):
+        self.config_path = config_path
         self.config = load_config(config_path)
         self._setup_logging()
         
@@ -21,7 +38,7 @@ class NEPService:
         # 初始化服务
         self.nep_server = NEPServer(self.config['nep'], self.storage)
         self.nept_server = NEPTServer(self.config['nept'], self.storage)
-        self.neph_server = NEPServer(self.config['neph'], self.storage)
+        self.neph_server = NEPHServer(self.config['neph'], self.storage)
         
         # 初始化Web应用
         self.web_app = create_app(self.config['web'], self.storage)
@@ -46,8 +63,33 @@ class NEPService:
         else:
             raise ValueError(f"Unknown storage type: {storage_type}")
 
+    async def _serve_web(self):
+        """在当前事件循环中运行Web管理应用"""
+        server = uvicorn.Server(uvicorn.Config(
+            self.web_app,
+            host=self.config['web']['host'],
+            port=self.config['web']['port'],
+            log_level="info",
+            loop="uvloop",
+            http="httptools",
+            access_log=False
+        ))
+        await server.serve()
+
+    def _start_neph_workers(self) -> List[multiprocessing.Process]:
+        """启动额外的NEP-H工作进程 (主进程本身也是一个工作进程)"""
+        # spawn使每个工作进程重新初始化存储，不继承主进程的连接
+        ctx = multiprocessing.get_context('spawn')
+        workers = []
+        for _ in range(self.neph_server.workers - 1):
+            process = ctx.Process(target=run_neph_worker, args=(self.config_path,), daemon=True)
+            process.start()
+            workers.append(process)
+        return workers
+
     async def start(self):
         """启动所有服务"""
+        neph_workers = self._start_neph_workers()
         try:
             # 启动NEP服务器
             nep_task = asyncio.create_task(self.nep_server.start())
@@ -59,13 +101,17 @@ class NEPService:
             neph_task = asyncio.create_task(self.neph_server.start())
             
             # 启动Web服务器
-            web_task = asyncio.create_task(self.web_app.run_task())
+            web_task = asyncio.create_task(self._serve_web())
             
             await asyncio.gather(nep_task, nept_task, neph_task, web_task)
         except Exception as e:
             logger.error(f"Service error: {e}")
             raise
+        finally:
+            for process in neph_workers:
+                process.terminate()
 
 if __name__ == '__main__':
+    _install_uvloop()
     service = NEPService()
     asyncio.run(service.start())
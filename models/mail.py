@@ -0,0 +1,65 @@
+import base64
+import sys
+import uuid
+from dataclasses import dataclass, field, fields
+from datetime import datetime, timezone
+from typing import Any, Dict, List
+
+import msgpack
+import orjson
+
+# Python 3.10+ 使用__slots__ (无实例__dict__) 和仅关键字参数
+_DATACLASS_OPTIONS = {'slots': True, 'kw_only': True} if sys.version_info >= (3, 10) else {}
+
+def json_default(obj):
+    """orjson的default钩子: NEP附件等二进制字段以base64字符串输出"""
+    if isinstance(obj, (bytes, bytearray, memoryview)):
+        return base64.b64encode(obj).decode('ascii')
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+def _generate_message_id() -> str:
+    return str(uuid.uuid4())
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+@dataclass(**_DATACLASS_OPTIONS)
+class EmailMessage:
+    """NEP邮件
+
+    字段名即序列化后的键名，orjson可直接序列化实例而无需先转换为dict。
+    """
+    from_addr: str
+    to_addrs: List[str]
+    subject: str
+    body: str
+    attachments: List[Dict[str, Any]] = field(default_factory=list)
+    flags: Dict[str, bool] = field(default_factory=dict)
+    message_id: str = field(default_factory=_generate_message_id)
+    created_at: datetime = field(default_factory=_utcnow)
+
+    def to_json(self) -> bytes:
+        """编码为JSON (NEP-H)"""
+        return orjson.dumps(self, default=json_default)
+
+def _make_msgpack_encoder(cls):
+    """为dataclass生成专用的MessagePack编码函数
+
+    map头和各字段键名只在此处编码一次，生成的函数只对字段值调用packer，
+    不构造中间dict。输出与将各字段按定义顺序放入dict后以
+    msgpack.packb(..., use_bin_type=True, datetime=True) 编码的结果相同
+    (未开启datetime时packb无法编码created_at)。
+    """
+    packer = msgpack.Packer(use_bin_type=True, datetime=True)
+    names = [f.name for f in fields(cls)]
+    namespace = {'_pack': packer.pack, '_HEADER': packer.pack_map_header(len(names))}
+    parts = []
+    for i, name in enumerate(names):
+        namespace[f'_K{i}'] = packer.pack(name)
+        parts.append(f'_K{i}, _pack(self.{name})')
+    source = f"def to_msgpack(self):\n    return b''.join((_HEADER, {', '.join(parts)}))\n"
+    exec(source, namespace)
+    return namespace['to_msgpack']
+
+# 编码为MessagePack (NEP)
+EmailMessage.to_msgpack = _make_msgpack_encoder(EmailMessage)
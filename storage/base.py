@@ -1,11 +1,33 @@
 from abc import ABC, abstractmethod
-from typing import List, Optional
+from typing import Callable, Dict, List, Optional
 
 from models.mail import EmailMessage
 from models.user import User
 
 class BaseStorage(ABC):
-    """存储抽象基类"""
+    """存储抽象基类
+
+    数据变更后通过 notify() 通知监听者:
+    用户信息修改或删除后调用 notify('user', user_id)，
+    邮箱中的邮件新增或标记更新后调用 notify('mailbox', 邮箱地址)。
+    调用 store_email() 的服务器在存储成功后调用 notify_email_stored()。
+    """
+    
+    def add_listener(self, callback: Callable[[str, str], None]):
+        """注册存储变更回调 callback(event, key)"""
+        if not hasattr(self, '_listeners'):
+            self._listeners = []
+        self._listeners.append(callback)
+        
+    def notify(self, event: str, key: str):
+        """通知所有监听者存储发生变更"""
+        for callback in getattr(self, '_listeners', ()):
+            callback(event, key)
+            
+    def notify_email_stored(self, email: EmailMessage):
+        """通知发件人和所有收件人的邮箱有新邮件"""
+        for address in [email.from_addr] + list(email.to_addrs):
+            self.notify('mailbox', address)
     
     @abstractmethod
     async def store_email(self, email: EmailMessage) -> str:
@@ -22,6 +44,19 @@ class BaseStorage(ABC):
         """列出邮件"""
         pass
         
+    async def list_emails_raw(self, email: str, mailbox: str, limit: int, offset: int,
+                              codec: str = 'json') -> List[bytes]:
+        """列出邮件，每封邮件为已编码的JSON或MessagePack ('json' | 'msgpack')
+
+        调用方直接拼接返回的编码结果，不再构造EmailMessage对象。默认实现基于
+        list_emails逐封编码；具体实现应在写入时预先保存编码结果 (如MySQL生成列、
+        Redis哈希字段) 并直接返回。
+        """
+        emails = await self.list_emails(email, mailbox, limit, offset)
+        if codec == 'msgpack':
+            return [e.to_msgpack() for e in emails]
+        return [e.to_json() for e in emails]
+        
     @abstractmethod
     async def update_email_flags(self, message_id: str, flags: Dict[str, bool]) -> bool:
         """更新邮件标记"""
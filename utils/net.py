@@ -0,0 +1,15 @@
+import socket
+import logging
+
+logger = logging.getLogger(__name__)
+
+def tune_socket(writer):
+    """为已接受的连接关闭Nagle算法，使小的回复立即发出"""
+    sock = writer.get_extra_info('socket')
+    if sock is None or sock.family not in (socket.AF_INET, socket.AF_INET6):
+        return
+        
+    try:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    except OSError as e:
+        logger.debug(f"Failed to tune socket: {e}")
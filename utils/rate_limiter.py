@@ -0,0 +1,45 @@
+import time
+from typing import Dict, List, Tuple
+
+# 速率限制周期 (秒)
+_PERIODS = {'second': 1, 'minute': 60, 'hour': 3600, 'day': 86400}
+
+def parse_rate(rate: str) -> Tuple[float, float]:
+    """解析 "100/hour" 格式的速率限制，返回 (桶容量, 每纳秒补充的令牌数)"""
+    count, _, period = rate.partition('/')
+    capacity = float(count)
+    return capacity, capacity / (_PERIODS[period.strip()] * 1_000_000_000)
+
+class RateLimiter:
+    """令牌桶速率限制器
+
+    所有服务器共享同一个事件循环，check_limit 内没有 await，
+    因此桶状态的读改写不会被打断，无需加锁。
+    """
+    
+    def __init__(self, limits: Dict[str, str]):
+        self.limits = {request_type: parse_rate(rate) for request_type, rate in limits.items()}
+        # (user_id, request_type) -> [剩余令牌数, 上次补充时间(ns)]
+        self._buckets: Dict[Tuple[str, str], List[float]] = {}
+
+    def check_limit(self, user_id: str, request_type: str) -> bool:
+        """消耗一个令牌，令牌不足时返回False"""
+        limit = self.limits.get(request_type)
+        if limit is None:
+            return True
+            
+        capacity, refill_rate = limit
+        now = time.monotonic_ns()
+        bucket = self._buckets.get((user_id, request_type))
+        if bucket is None:
+            self._buckets[(user_id, request_type)] = [capacity - 1, now]
+            return True
+            
+        tokens = min(capacity, bucket[0] + (now - bucket[1]) * refill_rate)
+        bucket[1] = now
+        if tokens < 1:
+            bucket[0] = tokens
+            return False
+            
+        bucket[0] = tokens - 1
+        return True
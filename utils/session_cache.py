@@ -0,0 +1,38 @@
+import hashlib
+from typing import Dict, Any, Optional
+
+from cachetools import TTLCache
+
+class SessionCache:
+    """认证会话缓存
+
+    以凭据的SHA-256摘要为键缓存认证成功的会话，相同凭据在TTL内重复认证时
+    不再访问存储。存储发出 'user' 事件 (如修改密码、删除用户) 时清除该用户的会话。
+    """
+    
+    def __init__(self, storage, maxsize: int = 10000, ttl: float = 60):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        storage.add_listener(self._on_storage_event)
+
+    @staticmethod
+    def _key(credentials: bytes) -> bytes:
+        return hashlib.sha256(credentials).digest()
+
+    def get(self, credentials: bytes) -> Optional[Dict[str, Any]]:
+        """查找缓存的会话，返回副本以免连接之间相互影响"""
+        session = self._cache.get(self._key(credentials))
+        return dict(session) if session is not None else None
+
+    def put(self, credentials: bytes, session: Dict[str, Any]):
+        """缓存认证成功的会话"""
+        self._cache[self._key(credentials)] = dict(session)
+
+    def invalidate_user(self, user_id: str):
+        """清除某个用户的全部缓存会话"""
+        for key, session in list(self._cache.items()):
+            if session.get('user_id') == user_id:
+                self._cache.pop(key, None)
+
+    def _on_storage_event(self, event: str, key: str):
+        if event == 'user':
+            self.invalidate_user(key)
@@ -1,4 +1,7 @@
+from typing import Dict, Any
+
 from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 
@@ -6,7 +9,7 @@ from storage.base import BaseStorage
 
 def create_app(config: Dict[str, Any], storage: BaseStorage):
     """创建Web应用"""
-    app = FastAPI(title="NEP Web Admin")
+    app = FastAPI(title="NEP Web Admin", default_response_class=ORJSONResponse)
     templates = Jinja2Templates(directory="templates")
     
     # 挂载静态文件